@@ -1,6 +1,7 @@
 import re
 import sys
-from attrs import define, field
+import itertools
+from attrs import define, field, setters
 from pathlib import Path
 from typing import Any, NewType
 from collections import defaultdict
@@ -57,9 +58,29 @@ SUFFIX_TO_ICON.update(
 # Create a dummy type to signify numbers need to be greater than 0.
 GreaterZero = NewType("GreaterZero", int)
 
+# Every edit to a profile or one of its sections is stamped with a new number from this counter,
+# so that data derived from a profile can tell when the profile was modified in place.
+_edit_counter = itertools.count(1)
 
-@define
+
+def stamp_edit(instance: Any, attribute: Any, value: Any) -> Any:
+    """
+    An attrs on_setattr hook that records that the instance was edited.
+    """
+    instance._edit_stamp = next(_edit_counter)
+    return value
+
+
+def edit_stamp_field() -> Any:
+    """
+    The field that holds the latest edit stamp. It doesn't take part in comparisons.
+    """
+    return field(default=0, init=False, eq=False, repr=False, on_setattr=setters.NO_OP)
+
+
+@define(on_setattr=stamp_edit)
 class GeneralConfig:
+    _edit_stamp: int = edit_stamp_field()
     preferred_file_type: str | None = None
     preferred_mask_file_type: str = ".png"
     input_size_scale: float | GreaterZero = 1.0
@@ -141,8 +162,9 @@ class GeneralConfig:
             self.preferred_mask_file_type = closest
 
 
-@define
+@define(on_setattr=stamp_edit)
 class TextDetectorConfig:
+    _edit_stamp: int = edit_stamp_field()
     model_path: str | None = None
     concurrent_models: int | GreaterZero = 1
 
@@ -204,8 +226,9 @@ class TextDetectorConfig:
                 self.model_path = None
 
 
-@define
+@define(on_setattr=stamp_edit)
 class PreprocessorConfig:
+    _edit_stamp: int = edit_stamp_field()
     box_min_size: int = 20 * 20
     suspicious_box_min_size: int = 200 * 200
     ocr_enabled: bool = True
@@ -325,8 +348,9 @@ class PreprocessorConfig:
             self.box_reference_padding = 0
 
 
-@define
+@define(on_setattr=stamp_edit)
 class MaskerConfig:
+    _edit_stamp: int = edit_stamp_field()
     mask_growth_step_pixels: int | GreaterZero = 2
     mask_growth_steps: int = 11
     off_white_max_threshold: int = 240
@@ -438,8 +462,9 @@ class MaskerConfig:
         self.debug_mask_color = tuple(max(0, min(255, x)) for x in self.debug_mask_color)
 
 
-@define
+@define(on_setattr=stamp_edit)
 class DenoiserConfig:
+    _edit_stamp: int = edit_stamp_field()
     denoising_enabled: bool = True
     noise_min_standard_deviation: float = 0.25
     noise_outline_size: int = 5
@@ -548,12 +573,13 @@ class DenoiserConfig:
             self.search_window_size = 0
 
 
-@define
+@define(on_setattr=stamp_edit)
 class Profile:
     """
     A profile is a collection of settings that can be saved and loaded from disk.
     """
 
+    _edit_stamp: int = edit_stamp_field()
     general: GeneralConfig = field(factory=GeneralConfig)
     text_detector: TextDetectorConfig = field(factory=TextDetectorConfig)
     preprocessor: PreprocessorConfig = field(factory=PreprocessorConfig)
@@ -585,6 +611,22 @@ class Profile:
         """
         return hash(str(self.bundle_config()))
 
+    def edit_version(self) -> int:
+        """
+        Get a number that changes whenever the profile or one of its sections is edited in place.
+        The stamps only ever increase, so the latest one among them identifies the current state.
+
+        :return: The edit version.
+        """
+        return max(
+            self._edit_stamp,
+            self.general._edit_stamp,
+            self.text_detector._edit_stamp,
+            self.preprocessor._edit_stamp,
+            self.masker._edit_stamp,
+            self.denoiser._edit_stamp,
+        )
+
     def write(self, path: Path) -> bool:
         """
         Write the profile to a file.
@@ -17,7 +17,7 @@ def denoise_page(d_data: st.DenoiserData) -> st.DenoiseAnalytic:
     :return: Analytics.
     """
     # Load all the cached data.
-    mask_data = st.MaskData.from_json(d_data.json_path.read_text())
+    mask_data = st.MaskData.from_json(d_data.json_path.read_text(encoding="utf-8"))
     mask_image = Image.open(mask_data.mask_path)
 
     # Scale the mask to the original image size, if needed.
@@ -13,6 +13,10 @@ class CElidedLabel(Qw.QFrame):
         self._elided = False
         self._content = text
         self._elideMode = Qc.Qt.ElideRight
+        # Cache the rendered text, so that repaints only need to draw the image.
+        self._cached_key = None
+        self._cached_image = None
+        self._cached_did_elide = False
         self.setSizePolicy(Qw.QSizePolicy.Expanding, Qw.QSizePolicy.Preferred)
         self.setFrameStyle(Qw.QFrame.NoFrame)
 
@@ -20,7 +24,10 @@ class CElidedLabel(Qw.QFrame):
         return self._content
 
     def setText(self, newText):
+        if newText == self._content:
+            return
         self._content = newText
+        self._cached_key = None
         self.update()
 
     def isElided(self):
@@ -32,21 +39,65 @@ class CElidedLabel(Qw.QFrame):
     def setElideMode(self, mode):
         if mode in [Qc.Qt.ElideLeft, Qc.Qt.ElideMiddle, Qc.Qt.ElideRight, Qc.Qt.ElideNone]:
             self._elideMode = mode
+            self._cached_key = None
             self.update()
         else:
             raise ValueError(f"Invalid elide mode {mode}")
 
+    def resizeEvent(self, event):
+        self._cached_key = None
+        super(CElidedLabel, self).resizeEvent(event)
+
+    def changeEvent(self, event):
+        # The pen color depends on the palette, and on the enabled and active state.
+        if event.type() in (
+            Qc.QEvent.FontChange,
+            Qc.QEvent.PaletteChange,
+            Qc.QEvent.EnabledChange,
+            Qc.QEvent.ActivationChange,
+            Qc.QEvent.StyleChange,
+        ):
+            self._cached_key = None
+        super(CElidedLabel, self).changeEvent(event)
+
     def paintEvent(self, event):
-        painter = Qg.QPainter(self)
-        fontMetrics = painter.fontMetrics()
+        key = (
+            self._content,
+            self.width(),
+            self.height(),
+            self.font().key(),
+            self._elideMode,
+            self.devicePixelRatioF(),
+            self.isEnabled(),
+            self.isActiveWindow(),
+        )
+        if key != self._cached_key:
+            self._render_text()
+            self._cached_key = key
+
+        if self._cached_image is not None:
+            painter = Qg.QPainter(self)
+            # Only repaint the region that Qt marked as dirty.
+            painter.setClipRegion(event.region())
+            painter.drawImage(0, 0, self._cached_image)
+            painter.end()
+
+        didElide = self._cached_did_elide
+        if didElide != self._elided:
+            self._elided = didElide
+            self.elisionChanged.emit(didElide)
+
+    def _render_text(self):
+        fontMetrics = self.fontMetrics()
 
         didElide = False
+        elidedLastLine = ""
         lineSpacing = fontMetrics.lineSpacing()
 
         # For vertical centering, calculate the y-position
         y = (self.height() - lineSpacing) // 2 + fontMetrics.ascent()
 
-        textLayout = Qg.QTextLayout(self._content, painter.font())
+        textLayout = Qg.QTextLayout(self._content, self.font())
         textLayout.beginLayout()
         while True:
             line = textLayout.createLine()
@@ -58,13 +109,29 @@ class CElidedLabel(Qw.QFrame):
 
             lastLine = self._content[line.textStart() :]
             elidedLastLine = fontMetrics.elidedText(lastLine, self._elideMode, self.width())
-            painter.drawText(Qc.QPoint(0, y), elidedLastLine)
             line = textLayout.createLine()
             didElide = line.isValid()
             break
 
         textLayout.endLayout()
 
-        if didElide != self._elided:
-            self._elided = didElide
-            self.elisionChanged.emit(didElide)
+        self._cached_did_elide = didElide
+        if self.width() <= 0 or self.height() <= 0:
+            self._cached_image = None
+            return
+
+        # Render the text into an image at the screen's pixel density, so it's a plain blit later.
+        ratio = self.devicePixelRatioF()
+        image = Qg.QImage(
+            round(self.width() * ratio),
+            round(self.height() * ratio),
+            Qg.QImage.Format_ARGB32_Premultiplied,
+        )
+        image.setDevicePixelRatio(ratio)
+        image.fill(Qc.Qt.transparent)
+        painter = Qg.QPainter(image)
+        painter.setFont(self.font())
+        painter.setPen(self.palette().color(self.foregroundRole()))
+        painter.drawText(Qc.QPoint(0, y), elidedLastLine)
+        painter.end()
+        self._cached_image = image
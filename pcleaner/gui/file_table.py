@@ -54,6 +54,7 @@ class FileTable(CTableWidget):
 
         # Store a map of resolved file paths to file objects.
         self.files: dict[Path, st.ImageFile] = {}
+        self.config: cfg.Config | None = None
         self.threadpool = Qc.QThreadPool.globalInstance()
         # self.finished_drop.connect(lambda: self.request_text_param_update.emit())
 
@@ -70,8 +71,8 @@ class FileTable(CTableWidget):
         else:
             self.table_not_empty.emit()
 
-    # def set_config(self, config: cfg.Config):
-    #     self.config = config
+    def set_config(self, config: cfg.Config):
+        self.config = config
 
     def handleDrop(self, path: str):
         logger.debug(f"Dropped {path}")
@@ -93,7 +94,12 @@ class FileTable(CTableWidget):
         for image in self.files.values():
             if not image.data_loaded():
                 # Start the text file worker.
-                worker = wt.Worker(self.image_loading_task, image=image, no_progress_callback=True)
+                worker = wt.Worker(
+                    self.image_loading_task,
+                    image=image,
+                    config=self.config,
+                    no_progress_callback=True,
+                )
                 logger.debug(f"Worker Thread loading image {image.path}")
 
                 worker.signals.result.connect(self.image_loading_worker_result)
@@ -167,14 +173,15 @@ class FileTable(CTableWidget):
     # =========================== Worker Tasks ===========================
 
     @staticmethod
-    def image_loading_task(image: st.ImageFile) -> Path:
+    def image_loading_task(image: st.ImageFile, config: cfg.Config | None) -> Path:
         """
         Thin wrapper to ensure the image object will be returned in the event of an error.
 
         :param image: The image to load.
+        :param config: The config, to find the thumbnail cache directory.
         :return: The path to the image for callbacks.
         """
-        return image.load_image()
+        return image.load_image(config)
 
     # ========================= Worker Callbacks =========================
 
@@ -183,6 +190,9 @@ class FileTable(CTableWidget):
         Update the table with the thumbnail.
         """
         logger.debug(f"Worker thread {file_path} finished.")
+        # The worker only decoded the thumbnail, the pixmap needs to be made in the gui thread.
+        if file_path in self.files:
+            self.files[file_path].finish_loading()
 
         # Search for the file in the table.
         for row in range(self.rowCount()):
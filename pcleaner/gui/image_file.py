@@ -1,20 +1,41 @@
-import io
-import zlib
+import copy
 import json
+import hashlib
+import operator
+import weakref
 import attrs
 from attrs import fields
+from functools import cache
 from pathlib import Path
-from typing import Iterable
+from typing import Any, Iterable
 from enum import Enum, auto
 
 import PySide6.QtGui as Qg
 from PIL import Image
+from logzero import logger
 
 import pcleaner.config as cfg
+import pcleaner.cli_utils as cli
 
 
 # The max size used for the icon and large thumbnail.
 THUMBNAIL_SIZE = 44, 44
+# Thumbnails are kept on disk between sessions, so images don't need to be decoded again.
+# This is the name of the subdirectory in the cache directory.
+THUMBNAIL_CACHE_SUBDIR = "thumbnails"
+# When the thumbnail cache grows past this size, the least recently modified entries are evicted.
+THUMBNAIL_CACHE_MAX_BYTES = 32 * 1024 * 1024
+# The cache only needs to be trimmed once per session.
+_thumbnail_cache_trimmed = False
+
+# Sensitive option names, grouped by profile section. None includes the entire section.
+SensitivityGroups = tuple[tuple[str, tuple[str, ...] | None], ...]
+
+# Profile checksums are shared between all steps with the same sensitivity, across all images.
+# Profiles are mutable, and therefore unhashable, so they are tracked by id along with their
+# edit version. Entries are dropped once the profile is edited or collected.
+_profile_versions: dict[int, int] = {}
+_checksum_cache: dict[tuple[int, int, SensitivityGroups | None], int] = {}
 
 
 class ProcessStep:
@@ -29,7 +50,9 @@ class ProcessStep:
 
     path: Path | None = None
     description: str
-    _sensitivity_filter: attrs.filters
+    _sensitivity_attrs: tuple[attrs.Attribute, ...] | None
+    _sensitivity_groups: SensitivityGroups | None
+    _sensitivity_getters: tuple[tuple[str, operator.attrgetter | None], ...] | None
     _current_profile_checksum: int | None = None
 
     def __init__(
@@ -37,9 +60,18 @@ class ProcessStep:
     ):
         self.description = description
         if profile_sensitivity is None:
-            self._sensitivity_filter = None
+            self._sensitivity_attrs = None
+            self._sensitivity_groups = None
+            self._sensitivity_getters = None
         else:
-            self._sensitivity_filter = attrs.filters.include(*profile_sensitivity)
+            self._sensitivity_attrs = tuple(profile_sensitivity)
+            self._sensitivity_groups = group_by_section(
+                profile_attribute_path(attribute) for attribute in self._sensitivity_attrs
+            )
+            self._sensitivity_getters = tuple(
+                (section, None if options is None else operator.attrgetter(*options))
+                for section, options in self._sensitivity_groups
+            )
 
     def has_path(self) -> bool:
         return self.path is not None
@@ -59,6 +91,9 @@ class ProcessStep:
         :param profile: The profile to check.
         :return: True if the profile has changed, False otherwise.
         """
+        # A step that never had its checksum set needs to be generated regardless.
+        if self._current_profile_checksum is None:
+            return True
         return self._current_profile_checksum != self._profile_checksum(profile)
 
     def _profile_checksum(self, profile: cfg.Profile) -> int:
@@ -68,10 +103,126 @@ class ProcessStep:
         :param profile: The profile to calculate the checksum for.
         :return: The checksum.
         """
-        serialized_data = json.dumps(
-            attrs.asdict(profile, filter=self._sensitivity_filter), sort_keys=True
-        ).encode()
-        return zlib.crc32(serialized_data)
+        # A step that isn't sensitive to any profile entry never changes.
+        if self._sensitivity_groups == ():
+            return 0
+
+        cache_key = (id(profile), profile_version(profile), self._sensitivity_groups)
+        checksum = _checksum_cache.get(cache_key)
+        if checksum is None:
+            checksum = self._compute_profile_checksum(profile)
+            _checksum_cache[cache_key] = checksum
+        return checksum
+
+    def _compute_profile_checksum(self, profile: cfg.Profile) -> int:
+        """
+        Hash the values of the profile entries that this step is sensitive to.
+
+        :param profile: The profile to calculate the checksum for.
+        :return: The checksum.
+        """
+        if self._sensitivity_getters is None:
+            return hash(freeze_value(profile))
+
+        # Only visit the sensitive options, section by section.
+        values = []
+        for section_name, getter in self._sensitivity_getters:
+            section = getattr(profile, section_name)
+            values.append(freeze_value(section if getter is None else getter(section)))
+        return hash(tuple(values))
+
+
+def profile_version(profile: cfg.Profile) -> int:
+    """
+    Get the current edit version of the profile, starting to track it if it's new.
+    Cached checksums of older versions are dropped.
+
+    :param profile: The profile to get the version of.
+    :return: The version number.
+    """
+    profile_id = id(profile)
+    version = profile.edit_version()
+    last_version = _profile_versions.get(profile_id)
+    if last_version is None:
+        weakref.finalize(profile, _forget_profile, profile_id)
+    elif last_version != version:
+        _drop_cached_checksums(profile_id)
+    _profile_versions[profile_id] = version
+    return version
+
+
+def _forget_profile(profile_id: int) -> None:
+    """
+    Stop tracking a profile that was garbage collected, as its id may be reused.
+
+    :param profile_id: The id of the collected profile.
+    """
+    _profile_versions.pop(profile_id, None)
+    _drop_cached_checksums(profile_id)
+
+
+def _drop_cached_checksums(profile_id: int) -> None:
+    for key in [key for key in _checksum_cache if key[0] == profile_id]:
+        del _checksum_cache[key]
+
+
+def profile_attribute_path(attribute: attrs.Attribute) -> tuple[str, ...]:
+    """
+    Find the chain of attribute names that leads from a profile to the given attribute.
+    The attribute may either be a section of the profile, or an option within a section.
+
+    :param attribute: The attrs attribute of the profile or one of its sections.
+    :return: The attribute names to follow, starting from the profile.
+    """
+    for section in fields(cfg.Profile):
+        # Skip the bookkeeping fields, they aren't settings.
+        if not section.eq:
+            continue
+        if section is attribute:
+            return (section.name,)
+        if any(option is attribute for option in fields(section.type)):
+            return section.name, attribute.name
+    raise ValueError(f"Attribute {attribute.name} is not part of the profile.")
+
+
+def group_by_section(paths: Iterable[tuple[str, ...]]) -> SensitivityGroups:
+    """
+    Group attribute paths by the profile section they belong to.
+    A path to the section itself includes all of its options, represented by None.
+
+    :param paths: The attribute paths, as given by profile_attribute_path.
+    :return: The section names with the option names in them.
+    """
+    groups: dict[str, list[str] | None] = {}
+    for section, *option in paths:
+        if not option:
+            groups[section] = None
+        elif groups.setdefault(section, []) is not None:
+            groups[section].append(option[0])
+    return tuple(
+        (section, None if options is None else tuple(options))
+        for section, options in groups.items()
+    )
+
+
+def freeze_value(value: Any) -> Any:
+    """
+    Recursively convert a value into a hashable equivalent.
+    Attrs instances and lists become tuples, dicts and sets become frozensets.
+    Fields excluded from comparisons, like edit stamps, are left out.
+
+    :param value: The value to freeze.
+    :return: The hashable value.
+    """
+    if attrs.has(type(value)):
+        return tuple(freeze_value(getattr(value, a.name)) for a in fields(type(value)) if a.eq)
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze_value(v) for v in value)
+    if isinstance(value, dict):
+        return frozenset((k, freeze_value(v)) for k, v in value.items())
+    if isinstance(value, set):
+        return frozenset(freeze_value(v) for v in value)
+    return value
 
 
 class Step(Enum):
@@ -98,8 +249,9 @@ class ImageFile:
     icon: Qg.QIcon  # Placeholder icon for the image type.
     # The following attributes are lazy-loaded.
     thumbnail: Qg.QPixmap | None = None  # Thumbnail of the image, used as the icon.
+    _thumbnail_image: Qg.QImage | None = None  # Decoded thumbnail, before becoming a pixmap.
     size: tuple[int, int] | None = None  # Size of the image.
-    steps: dict[Step, ProcessStep]  # Map of steps to ProcessStep objects.
+    _steps: dict[Step, ProcessStep] | None = None  # Map of steps to ProcessStep objects.
 
     error: Exception | None = None  # Error that occurred during any process.
 
@@ -112,76 +264,17 @@ class ImageFile:
         self.path = path
         self.icon = Qg.QIcon.fromTheme(cfg.SUFFIX_TO_ICON[path.suffix.lower()])
 
-        pro = fields(cfg.Profile)
-        gen = fields(cfg.GeneralConfig)
-        td = fields(cfg.TextDetectorConfig)
-        pp = fields(cfg.PreprocessorConfig)
-        mk = fields(cfg.MaskerConfig)
-        # dn = fields(cfg.DenoiserConfig)
-
-        # Init the process steps.
-        # Here I need to account for all the settings that affect each step.
-        settings = [gen.input_size_scale]
-        self.steps[Step.input] = ProcessStep(
-            "The original image with the scale factor applied.", settings
-        )
-
-        settings += [td.model_path]
-        self.steps[Step.ai_mask] = ProcessStep("The rough mask generated by the AI.", settings)
-
-        settings += [
-            pp.box_min_size,
-            pp.suspicious_box_min_size,
-            pp.box_padding_initial,
-            pp.box_right_padding_initial,
-        ]
-        self.steps[Step.initial_boxes] = ProcessStep(
-            "The outlines of the text boxes the AI found.", settings
-        )
-
-        settings += [pro.preprocessor]
-        self.steps[Step.final_boxes] = ProcessStep(
-            "The final boxes after expanding, merging and filtering unneeded boxes with OCR.\n"
-            "Green: initial boxes. Red: extended boxes. Purple: merged (final) boxes. "
-            "Blue: reference boxes for denoising.",
-            settings,
-        )
-        self.steps[Step.box_mask] = ProcessStep("The mask of the merged boxes.", settings)
-        self.steps[Step.cut_mask] = ProcessStep(
-            "The rough text detection mask with everything outside the box mask cut out.", settings
-        )
-
-        settings += [mk.mask_growth_step_pixels, mk.mask_growth_steps]
-        self.steps[Step.mask_layers] = ProcessStep(
-            "The different steps of growth around the cut mask displayed in different colors.",
-            settings,
-        )
-
-        settings += [
-            mk.off_white_max_threshold,
-            mk.mask_improvement_threshold,
-            mk.mask_selection_fast,
-            mk.mask_max_standard_deviation,
-        ]
-        self.steps[Step.final_mask] = ProcessStep(
-            "The collection of masks for each bubble that fit best.", settings
-        )
-
-        self.steps[Step.mask_overlay] = ProcessStep(
-            "The input image with the final mask overlaid in color.",
-            settings + [mk.debug_mask_color],
-        )
-        self.steps[Step.masked_image] = ProcessStep(
-            "The input image with the final mask applied.", settings
-        )
-
-        settings += [pro.denoiser]
-        self.steps[Step.denoiser_mask] = ProcessStep(
-            "The final mask overlaid on a denoised portion of the input image.", settings
-        )
-        self.steps[Step.denoised_image] = ProcessStep(
-            "The input image with the denoised mask applied.", settings
-        )
+    @property
+    def steps(self) -> dict[Step, ProcessStep]:
+        """
+        Returns the map of steps to ProcessStep objects.
+        These are only created once needed, since most images are never inspected in detail.
+        """
+        if self._steps is None:
+            self._steps = {
+                step: copy.copy(template) for step, template in build_step_templates().items()
+            }
+        return self._steps
 
     @property
     def size_str(self) -> str:
@@ -198,20 +291,221 @@ class ImageFile:
         """
         return self.thumbnail is not None and self.size is not None
 
-    def load_image(self) -> Path:
+    def load_image(self, config: cfg.Config | None = None) -> Path:
         """
         Loads the image data.
+        This only decodes the thumbnail to a QImage, so it is safe to run in a worker thread.
+        Call finish_loading from the gui thread afterwards to create the thumbnail pixmap.
 
+        :param config: [Optional] The config, to find the cache directory for thumbnails.
+            Without it, the system default cache directory is used.
         :return: Path to the image file so that the callback knows which image was loaded.
         """
+        cache_path = thumbnail_cache_path(self.path, config)
+        thumbnail = None
+        if cache_path is not None:
+            thumbnail = self.load_cached_thumbnail(cache_path)
+        if thumbnail is None:
+            thumbnail = self.decode_thumbnail()
+            if cache_path is not None:
+                self.save_cached_thumbnail(cache_path, thumbnail)
+        self._thumbnail_image = thumbnail
+
+        return self.path
+
+    def finish_loading(self) -> None:
+        """
+        Convert the decoded thumbnail to a pixmap.
+        Pixmaps may only be created in the gui thread.
+        """
+        if self._thumbnail_image is not None:
+            self.thumbnail = Qg.QPixmap.fromImage(self._thumbnail_image)
+            self._thumbnail_image = None
+
+    def decode_thumbnail(self) -> Qg.QImage:
+        """
+        Decode the image file into a thumbnail, recording the full image size.
+
+        :return: The thumbnail.
+        """
         image = Image.open(self.path)
+        # Record the full size before the draft mode changes it.
         self.size = image.size
         # Shrink the image down to a thumbnail size to reduce memory usage.
-        thumbnail = image.copy()
-        thumbnail.thumbnail(THUMBNAIL_SIZE)
-        self.thumbnail = convert_PIL_to_QPixmap(thumbnail)
+        # Draft mode lets the JPEG decoder scale down while decoding, other formats ignore it.
+        # The full image isn't kept around, so thumbnail it in place.
+        image.draft("RGB", THUMBNAIL_SIZE)
+        image.thumbnail(THUMBNAIL_SIZE, Image.Resampling.BILINEAR, reducing_gap=2.0)
+        return convert_PIL_to_QImage(image)
 
-        return self.path
+    def load_cached_thumbnail(self, cache_path: Path) -> Qg.QImage | None:
+        """
+        Attempt to load the thumbnail and image size from the thumbnail cache.
+
+        :param cache_path: Path to the cached thumbnail.
+        :return: The cached thumbnail, or None if it wasn't cached.
+        """
+        size_path = cache_path.with_suffix(".json")
+        if not cache_path.is_file() or not size_path.is_file():
+            return None
+        try:
+            width, height = json.loads(size_path.read_text())
+        except (OSError, ValueError, TypeError):
+            return None
+        thumbnail = Qg.QImage(str(cache_path))
+        if thumbnail.isNull():
+            return None
+        self.size = width, height
+        return thumbnail
+
+    def save_cached_thumbnail(self, cache_path: Path, thumbnail: Qg.QImage) -> None:
+        """
+        Save the thumbnail and image size to the thumbnail cache.
+        Failing to do so is not fatal, the thumbnail will simply be generated again next time.
+
+        :param cache_path: Path to save the thumbnail to.
+        :param thumbnail: The thumbnail to save.
+        """
+        global _thumbnail_cache_trimmed
+        try:
+            cache_path.parent.mkdir(parents=True, exist_ok=True)
+            if not thumbnail.save(str(cache_path), "PNG"):
+                raise OSError(f"Failed to write {cache_path}")
+            cache_path.with_suffix(".json").write_text(json.dumps(list(self.size)))
+        except OSError as e:
+            logger.warning(f"Failed to cache thumbnail for {self.path}: {e}")
+            return
+
+        if not _thumbnail_cache_trimmed:
+            _thumbnail_cache_trimmed = True
+            trim_thumbnail_cache(cache_path.parent, THUMBNAIL_CACHE_MAX_BYTES)
+
+
+def thumbnail_cache_path(image_path: Path, config: cfg.Config | None = None) -> Path | None:
+    """
+    Get the path to the cached thumbnail for the given image.
+    The key includes the modification time and file size, so edited images get a new thumbnail.
+    Failing to find the cache directory is not fatal, the thumbnail simply isn't cached.
+
+    :param image_path: Path to the image file.
+    :param config: [Optional] The config, to use a custom cache directory if set.
+    :return: Path to the cached thumbnail, or None if thumbnails can't be cached.
+    """
+    try:
+        cache_dir = config.get_cache_dir() if config is not None else cli.get_cache_path()
+        stat = image_path.stat()
+    except Exception as e:
+        logger.warning(f"Not caching thumbnail for {image_path}: {e}")
+        return None
+    key = hashlib.blake2b(
+        f"{image_path.resolve()}:{stat.st_mtime_ns}:{stat.st_size}".encode(), digest_size=16
+    ).hexdigest()
+    return cache_dir / THUMBNAIL_CACHE_SUBDIR / f"{key}.png"
+
+
+def trim_thumbnail_cache(cache_dir: Path, max_bytes: int) -> None:
+    """
+    Delete the least recently modified thumbnails until the cache fits within the size limit.
+
+    :param cache_dir: The thumbnail cache directory.
+    :param max_bytes: The maximum total size of the cache.
+    """
+    try:
+        entries = [(item, item.stat()) for item in cache_dir.glob("*.png")]
+    except OSError as e:
+        logger.warning(f"Failed to read thumbnail cache {cache_dir}: {e}")
+        return
+
+    total_size = sum(stat.st_size for _, stat in entries)
+    if total_size <= max_bytes:
+        return
+
+    entries.sort(key=lambda entry: entry[1].st_mtime)
+    for item, stat in entries:
+        if total_size <= max_bytes:
+            break
+        item.unlink(missing_ok=True)
+        item.with_suffix(".json").unlink(missing_ok=True)
+        total_size -= stat.st_size
+
+
+@cache
+def build_step_templates() -> dict[Step, ProcessStep]:
+    """
+    Create the process steps, without any state attached.
+    The descriptions and profile sensitivities are the same for every image,
+    so they are built once and copied for each image that needs them.
+
+    :return: A map of steps to template ProcessStep objects.
+    """
+    pro = fields(cfg.Profile)
+    gen = fields(cfg.GeneralConfig)
+    td = fields(cfg.TextDetectorConfig)
+    pp = fields(cfg.PreprocessorConfig)
+    mk = fields(cfg.MaskerConfig)
+    # dn = fields(cfg.DenoiserConfig)
+
+    # Init the process steps.
+    steps: dict[Step, ProcessStep] = {}
+    # Here I need to account for all the settings that affect each step.
+    settings = [gen.input_size_scale]
+    steps[Step.input] = ProcessStep("The original image with the scale factor applied.", settings)
+
+    settings += [td.model_path]
+    steps[Step.ai_mask] = ProcessStep("The rough mask generated by the AI.", settings)
+
+    settings += [
+        pp.box_min_size,
+        pp.suspicious_box_min_size,
+        pp.box_padding_initial,
+        pp.box_right_padding_initial,
+    ]
+    steps[Step.initial_boxes] = ProcessStep(
+        "The outlines of the text boxes the AI found.", settings
+    )
+
+    settings += [pro.preprocessor]
+    steps[Step.final_boxes] = ProcessStep(
+        "The final boxes after expanding, merging and filtering unneeded boxes with OCR.\n"
+        "Green: initial boxes. Red: extended boxes. Purple: merged (final) boxes. "
+        "Blue: reference boxes for denoising.",
+        settings,
+    )
+    steps[Step.box_mask] = ProcessStep("The mask of the merged boxes.", settings)
+    steps[Step.cut_mask] = ProcessStep(
+        "The rough text detection mask with everything outside the box mask cut out.", settings
+    )
+
+    settings += [mk.mask_growth_step_pixels, mk.mask_growth_steps]
+    steps[Step.mask_layers] = ProcessStep(
+        "The different steps of growth around the cut mask displayed in different colors.",
+        settings,
+    )
+
+    settings += [
+        mk.off_white_max_threshold,
+        mk.mask_improvement_threshold,
+        mk.mask_selection_fast,
+        mk.mask_max_standard_deviation,
+    ]
+    steps[Step.final_mask] = ProcessStep(
+        "The collection of masks for each bubble that fit best.", settings
+    )
+
+    steps[Step.mask_overlay] = ProcessStep(
+        "The input image with the final mask overlaid in color.",
+        settings + [mk.debug_mask_color],
+    )
+    steps[Step.masked_image] = ProcessStep("The input image with the final mask applied.", settings)
+
+    settings += [pro.denoiser]
+    steps[Step.denoiser_mask] = ProcessStep(
+        "The final mask overlaid on a denoised portion of the input image.", settings
+    )
+    steps[Step.denoised_image] = ProcessStep(
+        "The input image with the denoised mask applied.", settings
+    )
+    return steps
 
 
 def convert_PIL_to_QPixmap(image: Image.Image) -> Qg.QPixmap:
@@ -221,12 +515,39 @@ def convert_PIL_to_QPixmap(image: Image.Image) -> Qg.QPixmap:
     :param image: PIL image.
     :return: QPixmap.
     """
+    return Qg.QPixmap.fromImage(convert_PIL_to_QImage(image))
+
+
+def convert_PIL_to_QImage(image: Image.Image) -> Qg.QImage:
+    """
+    Converts a PIL image to a QImage.
+    Unlike pixmaps, this is safe to do outside the gui thread.
+
+    :param image: PIL image.
+    :return: QImage.
+    """
     if image.mode == "CMYK":
         image = image.convert("RGB")
-    byte_data = io.BytesIO()
-    image.save(byte_data, format="PNG")
-    byte_data.seek(0)
-    qimage = Qg.QPixmap()
-    # noinspection PyTypeChecker
-    qimage.loadFromData(byte_data.read(), "PNG")
-    return qimage
+    # Scale 16-bit, 32-bit and float grayscale down to 8-bit, since converting clamps them.
+    if image.mode.startswith("I;16"):
+        image = image.convert("I").point(lambda v: v / 256).convert("L")
+    elif image.mode in ("I", "F"):
+        # The value range of these varies, e.g. 0-1 for float images, so scale to the extrema.
+        # Keep zero as black, unless there are negative values.
+        low, high = image.getextrema()
+        low = min(low, 0)
+        if high > low:
+            scale = 255 / (high - low)
+            image = image.point(lambda v: (v - low) * scale)
+        image = image.convert("L")
+    if image.mode not in ("RGB", "RGBA"):
+        image = image.convert("RGBA")
+    # Hand the raw pixel buffer straight to Qt, rather than round-tripping through a PNG.
+    if image.mode == "RGBA":
+        bytes_per_pixel, image_format = 4, Qg.QImage.Format_RGBA8888
+    else:
+        bytes_per_pixel, image_format = 3, Qg.QImage.Format_RGB888
+    data = image.tobytes("raw", image.mode)
+    qimage = Qg.QImage(data, image.width, image.height, image.width * bytes_per_pixel, image_format)
+    # Copy the QImage to detach it from the python-owned buffer.
+    return qimage.copy()
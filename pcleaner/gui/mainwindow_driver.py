@@ -44,6 +44,8 @@ class MainWindow(Qw.QMainWindow, Ui_MainWindow):
         self.processing = False
 
         self.config = cfg.load_config()
+        # Share config with the file table.
+        self.file_table.set_config(self.config)
 
         self.initialize_ui()
         #
@@ -16,7 +16,7 @@ def clean_page(m_data: st.MaskerData) -> list[tuple[Path, bool, int, float]]:
         the best mask, and the border uniformity of the best mask for each box.
     """
 
-    page_data = st.PageData.from_json(m_data.json_path.read_text())
+    page_data = st.PageData.from_json(m_data.json_path.read_text(encoding="utf-8"))
 
     # Make a shorter alias.
     g_conf = m_data.general_config
@@ -68,7 +68,8 @@ def clean_page(m_data: st.MaskerData) -> list[tuple[Path, bool, int, float]]:
             analytics_page_path=Path(original_img_path_as_png),
         )
         for masking_box, reference_box in zip(
-            page_data.merged_extended_boxes, page_data.reference_boxes
+            page_data.iter_boxes(st.BoxType.MERGED_EXT_BOX),
+            page_data.iter_boxes(st.BoxType.REFERENCE_BOX),
         )
     ]
     # Take out all entries that are None, since these masks were false positives.
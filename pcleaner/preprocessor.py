@@ -1,6 +1,5 @@
 import json
 import re
-from dataclasses import asdict
 from pathlib import Path
 from functools import partial
 
@@ -96,7 +95,16 @@ def prep_json_file(
     # Sort boxes by their x+y coordinates, using the top right corner as the reference.
     boxes.sort(key=lambda box: box[1] - 0.4 * box[2])
 
-    page_data = st.PageData(image_path, mask_path, original_path, scale, boxes, [], [], [])
+    page_data = st.PageData(
+        image_path,
+        mask_path,
+        original_path,
+        scale,
+        st.flatten_boxes(boxes),
+        st.flatten_boxes([]),
+        st.flatten_boxes([]),
+        st.flatten_boxes([]),
+    )
 
     # Pad the boxes a bit, save a copy, and then pad them some more.
     # The copy is used as a smaller mask, and the padded copy is used as a larger mask.
@@ -119,8 +127,8 @@ def prep_json_file(
             preprocessor_conf.ocr_blacklist_pattern,
         )
 
-    # A shallow copy of the box list suffices, because the tuples inside are immutable.
-    page_data.extended_boxes = page_data.boxes.copy()
+    # Slicing copies the flat box array.
+    page_data.extended_boxes = page_data.boxes[:]
 
     page_data.grow_boxes(scale_len(preprocessor_conf.box_padding_extended), st.BoxType.EXTENDED_BOX)
     page_data.right_pad_boxes(
@@ -128,21 +136,18 @@ def prep_json_file(
     )
 
     # Check for overlapping boxes among the extended boxes.
-    # The resulting list is saved in the page_data.merged_extended_boxes attribute.
+    # The resulting boxes are saved in the page_data.merged_extended_boxes attribute.
     page_data.resolve_overlaps()
 
     # Copy the merged extended boxes to the reference boxes and grow them once again.
-    page_data.reference_boxes = page_data.merged_extended_boxes.copy()
+    page_data.reference_boxes = page_data.merged_extended_boxes[:]
     page_data.grow_boxes(
         scale_len(preprocessor_conf.box_reference_padding), st.BoxType.REFERENCE_BOX
     )
 
     # Write the json file with the cleaned data.
     json_out_path = json_file_path.parent / f"{json_file_path.stem.replace('#raw', '')}#clean.json"
-    # Remove the _image_size attribute, because it's a cached value that may be unset.
-    page_data_dict = asdict(page_data)
-    del page_data_dict["_image_size"]
-    json_out_path.write_text(json.dumps(page_data_dict, indent=4))
+    page_data.write_json(json_out_path)
 
     # Draw the boxes on the image and save it.
     if cache_masks and not cache_masks_ocr:
@@ -191,10 +196,12 @@ def ocr_check(
     """
     base_image = Image.open(page_data.image_path)
     candidate_small_bubbles = [
-        box for box in page_data.boxes if page_data.box_size(box) < max_box_size
+        box
+        for box in page_data.iter_boxes(st.BoxType.BOX)
+        if page_data.box_size(box) < max_box_size
     ]
     if not candidate_small_bubbles:
-        return page_data, (len(page_data.boxes), (), (), ())
+        return page_data, (page_data.box_count(st.BoxType.BOX), (), (), ())
     # Check if the small bubbles only contain symbols.
     # If they do, then they are probably not text.
     # Discard them in that case.
@@ -210,10 +217,10 @@ def ocr_check(
         if remove:
             discarded_box_texts.append((page_data.original_path, text, box))
             discarded_box_sizes.append(box_size)
-            page_data.boxes.remove(box)
+            page_data.remove_box(box, st.BoxType.BOX)
 
     return page_data, (
-        len(page_data.boxes) + len(discarded_box_sizes),
+        page_data.box_count(st.BoxType.BOX) + len(discarded_box_sizes),
         tuple(box_sizes),
         tuple(discarded_box_sizes),
         tuple(discarded_box_texts),
@@ -1,17 +1,35 @@
+import heapq
 import json
-import re
+from array import array
+import struct
+import sys
 from dataclasses import dataclass
 from enum import Enum
+from functools import lru_cache
+from itertools import chain
 from pathlib import Path
+from typing import Iterable, Iterator
 from importlib import resources
 from pcleaner import data
 
-import magic
+import numpy as np
 from PIL import Image, ImageDraw, ImageFont
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 import pcleaner.config as cfg
 
 
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+# Paths are loaded over and over again from the json files, so share the Path objects.
+PATH_INTERN_MAX_SIZE = 4096
+_path_intern: dict[str, Path] = {}
+
+
 class BoxType(Enum):
     BOX = 0
     EXTENDED_BOX = 1
@@ -19,7 +37,7 @@ class BoxType(Enum):
     REFERENCE_BOX = 3
 
 
-@dataclass
+@dataclass(slots=True)
 class PageData:
     """
     This dataclass represents the json data generated by the ai model.
@@ -39,16 +57,17 @@ class PageData:
 
     Boxes are represented as tuples of (x1, y1, x2, y2), where (x1, y1) is the top left corner,
     and (x2, y2) is the bottom right corner.
+    They are stored flat in int arrays, four entries per box, use iter_boxes to get the tuples.
     """
 
     image_path: str  # Path to the copied png.
     mask_path: str  # Path to the generated mask.png
     original_path: str  # Path to the original image. (used for relative output)
     scale: float  # The size of the original image relative to the png.
-    boxes: list[tuple[int, int, int, int]]
-    extended_boxes: list[tuple[int, int, int, int]]
-    merged_extended_boxes: list[tuple[int, int, int, int]]
-    reference_boxes: list[tuple[int, int, int, int]]
+    boxes: array
+    extended_boxes: array
+    merged_extended_boxes: array
+    reference_boxes: array
     _image_size: tuple[
         int, int
     ] = None  # Cache the image size, so we don't have to load the image every time.
@@ -60,27 +79,52 @@ class PageData:
 
         :param json_str: The json string to load from.
         """
-        json_data = json.loads(json_str)
+        json_data = load_json(json_str)
         return cls(
-            json_data["image_path"],
-            json_data["mask_path"],
-            json_data["original_path"],
+            sys.intern(json_data["image_path"]),
+            sys.intern(json_data["mask_path"]),
+            sys.intern(json_data["original_path"]),
             json_data["scale"],
-            json_data["boxes"],
-            json_data["extended_boxes"],
-            json_data["merged_extended_boxes"],
-            json_data["reference_boxes"],
+            flatten_boxes(json_data["boxes"]),
+            flatten_boxes(json_data["extended_boxes"]),
+            flatten_boxes(json_data["merged_extended_boxes"]),
+            flatten_boxes(json_data["reference_boxes"]),
         )
 
+    def write_json(self, json_path: Path):
+        """
+        Write the PageData object to a json file, with the boxes as lists of coordinates.
+        The cached image size is left out, since it may be unset.
+
+        :param json_path: The path to write the json file to.
+        """
+        data = {
+            "image_path": self.image_path,
+            "mask_path": self.mask_path,
+            "original_path": self.original_path,
+            "scale": self.scale,
+            "boxes": list(self.iter_boxes(BoxType.BOX)),
+            "extended_boxes": list(self.iter_boxes(BoxType.EXTENDED_BOX)),
+            "merged_extended_boxes": list(self.iter_boxes(BoxType.MERGED_EXT_BOX)),
+            "reference_boxes": list(self.iter_boxes(BoxType.REFERENCE_BOX)),
+        }
+        dump_json(data, json_path)
+
     @property
     def image_size(self):
         if self._image_size is None:
-            metadata = magic.from_file(self.image_path)
-            size_str = re.search(r"(\d+) x (\d+)", metadata).groups()
-            self._image_size = (int(size_str[0]), int(size_str[1]))
+            # The image is a png, so the size can be read from the IHDR chunk at the start of the
+            # file, without decoding anything. Fall back to PIL for anything else.
+            with open(self.image_path, "rb") as file:
+                header = file.read(24)
+            if header[:8] == PNG_SIGNATURE and header[12:16] == b"IHDR":
+                self._image_size = struct.unpack(">II", header[16:24])
+            else:
+                with Image.open(self.image_path) as image:
+                    self._image_size = image.size
         return self._image_size
 
-    def boxes_from_type(self, box_type: BoxType) -> list[tuple[int, int, int, int]]:
+    def boxes_from_type(self, box_type: BoxType) -> array:
         match box_type:
             case BoxType.BOX:
                 return self.boxes
@@ -93,6 +137,39 @@ class PageData:
             case _:
                 raise ValueError("Invalid box type.")
 
+    def iter_boxes(self, box_type: BoxType) -> Iterator[tuple[int, int, int, int]]:
+        """
+        Iterate over the boxes of the given type as (x1, y1, x2, y2) tuples.
+
+        :param box_type: type of box to iterate over.
+        :return: An iterator of box tuples.
+        """
+        boxes = self.boxes_from_type(box_type)
+        return zip(boxes[0::4], boxes[1::4], boxes[2::4], boxes[3::4])
+
+    def box_count(self, box_type: BoxType) -> int:
+        """
+        Count the boxes of the given type.
+
+        :param box_type: type of box to count.
+        :return: The number of boxes.
+        """
+        return len(self.boxes_from_type(box_type)) // 4
+
+    def remove_box(self, box: tuple[int, int, int, int], box_type: BoxType):
+        """
+        Remove the first occurrence of a box.
+
+        :param box: The box to remove.
+        :param box_type: type of box to remove it from.
+        """
+        boxes = self.boxes_from_type(box_type)
+        for index, other in enumerate(self.iter_boxes(box_type)):
+            if other == tuple(box):
+                del boxes[index * 4 : index * 4 + 4]
+                return
+        raise ValueError(f"Box {box} not found.")
+
     def grow_boxes(self, padding: int, box_type: BoxType):
         """
         Uniformly grow all boxes by padding pixels.
@@ -104,14 +181,11 @@ class PageData:
         boxes = self.boxes_from_type(box_type)
         image_width, image_height = self.image_size
 
-        for i in range(len(boxes)):
-            x1, y1, x2, y2 = boxes[i]
-            boxes[i] = (
-                max(x1 - padding, 0),
-                max(y1 - padding, 0),
-                min(x2 + padding, image_width),
-                min(y2 + padding, image_height),
-            )
+        # Edit the boxes in place, through a numpy view of the flat array.
+        box_array = box_view(boxes)
+        box_array[:, :2] = np.maximum(box_array[:, :2] - padding, 0)
+        box_array[:, 2] = np.minimum(box_array[:, 2] + padding, image_width)
+        box_array[:, 3] = np.minimum(box_array[:, 3] + padding, image_height)
 
     def right_pad_boxes(self, padding: int, box_type: BoxType):
         """
@@ -124,9 +198,8 @@ class PageData:
         boxes = self.boxes_from_type(box_type)
         image_width, _ = self.image_size
 
-        for i in range(len(boxes)):
-            x1, y1, x2, y2 = boxes[i]
-            boxes[i] = (x1, y1, min(x2 + padding, image_width), y2)
+        box_array = box_view(boxes)
+        box_array[:, 2] = np.minimum(box_array[:, 2] + padding, image_width)
 
     @staticmethod
     def box_size(box: tuple[int, int, int, int]) -> int:
@@ -155,8 +228,9 @@ class PageData:
             font_path = str(data_path / "LiberationSans-Regular.ttf")
         # Figure out the optimal font size based on the image size. E.g. 30 for a 1600px image.
         font_size = int(image.size[0] / 50)
+        font = load_font(font_path, font_size)
 
-        for index, box in enumerate(self.boxes):
+        for index, box in enumerate(self.iter_boxes(BoxType.BOX)):
             draw.rectangle(box, outline="green")
             # Draw the box number, with a white background, respecting font size.
             draw.rectangle(
@@ -168,15 +242,15 @@ class PageData:
                 (box[2] - font_size, box[1]),
                 str(index + 1),
                 fill="green",
-                font=ImageFont.truetype(font_path, font_size),
+                font=font,
                 direction="rtl",
             )
 
-        for box in self.extended_boxes:
+        for box in self.iter_boxes(BoxType.EXTENDED_BOX):
             draw.rectangle(box, outline="red")
-        for box in self.merged_extended_boxes:
+        for box in self.iter_boxes(BoxType.MERGED_EXT_BOX):
             draw.rectangle(box, outline="purple")
-        for box in self.reference_boxes:
+        for box in self.iter_boxes(BoxType.REFERENCE_BOX):
             draw.rectangle(box, outline="blue")
         # Save the image.
         extension = "_boxes" if not final_boxes else "_boxes_final"
@@ -195,58 +269,164 @@ class PageData:
         :param box_type: The type of box to use.
         :return: The mask. Image mode: "1"
         """
-        box_mask = Image.new("1", image_size, (0,))
-        draw = ImageDraw.Draw(box_mask)
-        boxes = self.boxes_from_type(box_type)
-        for box in boxes:
-            draw.rectangle(box, fill=(1,))
-        return box_mask
+        width, height = image_size
+        mask_array = np.zeros((height, width), dtype=bool)
+        for x1, y1, x2, y2 in self.iter_boxes(box_type):
+            # Rectangles include their bottom right corner, like when drawing them with PIL.
+            # Clamp both ends, since numpy would count negative stops back from the end.
+            mask_array[max(y1, 0) : max(y2 + 1, 0), max(x1, 0) : max(x2 + 1, 0)] = True
+        return Image.fromarray(mask_array)
 
     def resolve_overlaps(self):
         """
         Copy the extended boxes to the merged extended boxes, and merge overlapping boxes.
+        Merging is repeated until the merged boxes no longer overlap each other either.
         """
+        boxes = list(self.iter_boxes(BoxType.EXTENDED_BOX))
+        while True:
+            merged_boxes = merge_overlapping_boxes(boxes)
+            if len(merged_boxes) == len(boxes):
+                break
+            boxes = merged_boxes
 
-        def boxes_overlap(box1: tuple[int, int, int, int], box2: tuple[int, int, int, int]) -> bool:
-            x1_min, y1_min, x1_max, y1_max = box1
-            x2_min, y2_min, x2_max, y2_max = box2
+        self.merged_extended_boxes = flatten_boxes(merged_boxes)
 
-            x_overlap = (x1_min <= x2_max) and (x2_min <= x1_max)
-            y_overlap = (y1_min <= y2_max) and (y2_min <= y1_max)
 
-            # If both dimensions overlap, then the boxes overlap.
-            return x_overlap and y_overlap
+def intern_path(path_str: str) -> Path:
+    """
+    Get a shared Path object for the given path string.
+    The oldest entries are evicted once the cache is full.
 
-        def merge_boxes(
-            box1: tuple[int, int, int, int], box2: tuple[int, int, int, int]
-        ) -> tuple[int, int, int, int]:
-            x1_min, y1_min, x1_max, y1_max = box1
-            x2_min, y2_min, x2_max, y2_max = box2
+    :param path_str: The path as a string.
+    :return: The Path object.
+    """
+    path = _path_intern.get(path_str)
+    if path is None:
+        if len(_path_intern) >= PATH_INTERN_MAX_SIZE:
+            del _path_intern[next(iter(_path_intern))]
+        path = _path_intern[path_str] = Path(path_str)
+    return path
 
-            x_min = min(x1_min, x2_min)
-            y_min = min(y1_min, y2_min)
-            x_max = max(x1_max, x2_max)
-            y_max = max(y1_max, y2_max)
 
-            return x_min, y_min, x_max, y_max
+def load_json(json_str: str | bytes):
+    """
+    Parse a json string, using orjson when it is available.
+
+    :param json_str: The json string to parse.
+    :return: The parsed data.
+    """
+    if orjson is not None:
+        return orjson.loads(json_str)
+    return json.loads(json_str)
+
+
+def dump_json(data, json_path: Path):
+    """
+    Write data to a json file, using orjson when it is available.
+    Both paths produce the same layout: UTF-8 with an indentation of 2 spaces.
+
+    :param data: The data to write.
+    :param json_path: The path to write the json file to.
+    """
+    if orjson is not None:
+        json_path.write_bytes(
+            orjson.dumps(data, option=orjson.OPT_INDENT_2 | orjson.OPT_SERIALIZE_NUMPY)
+        )
+    else:
+        json_path.write_text(json.dumps(data, indent=2, ensure_ascii=False), encoding="utf-8")
+
+
+@lru_cache(maxsize=32)
+def load_font(font_path: str, font_size: int) -> ImageFont.FreeTypeFont:
+    """
+    Load a truetype font, reusing it for every page with the same font size.
+
+    :param font_path: The path to the font file.
+    :param font_size: The font size.
+    :return: The font.
+    """
+    return ImageFont.truetype(font_path, font_size)
 
-        # Place the extended boxes in the merged extended boxes, merging overlapping boxes.
-        merge_queue = set(self.extended_boxes)
-        merged_boxes = []
-        while merge_queue:
-            box = merge_queue.pop()
-            # Find all boxes that overlap with this box.
-            overlapping_boxes = [b for b in merge_queue if boxes_overlap(box, b)]
-            # Merge all overlapping boxes.
-            for b in overlapping_boxes:
-                box = merge_boxes(box, b)
-                merge_queue.remove(b)
-            merged_boxes.append(box)
 
-        self.merged_extended_boxes = merged_boxes
+def merge_overlapping_boxes(
+    boxes: list[tuple[int, int, int, int]]
+) -> list[tuple[int, int, int, int]]:
+    """
+    Merge all groups of overlapping boxes into their bounding boxes.
+    Sweep over the boxes from left to right, only comparing boxes whose x-ranges overlap,
+    and join the overlapping ones with a union-find structure.
+
+    :param boxes: The boxes to merge.
+    :return: The merged boxes, one per group of overlapping boxes.
+    """
+    if not boxes:
+        return []
+
+    parents = list(range(len(boxes)))
+    # Heap of (x_max, index) for the boxes that may still overlap with the sweep position.
+    active: list[tuple[int, int]] = []
+    for index in sorted(range(len(boxes)), key=lambda i: boxes[i][0]):
+        x_min, y_min, x_max, y_max = boxes[index]
+        # Boxes that end before this one starts can't overlap with any following boxes.
+        while active and active[0][0] < x_min:
+            heapq.heappop(active)
+        for _, other in active:
+            if boxes[other][1] <= y_max and y_min <= boxes[other][3]:
+                parents[find_root(parents, other)] = find_root(parents, index)
+        heapq.heappush(active, (x_max, index))
+
+    groups: dict[int, list[int]] = {}
+    for index in range(len(boxes)):
+        groups.setdefault(find_root(parents, index), []).append(index)
+
+    box_array = box_view(flatten_boxes(boxes))
+    merged_boxes = []
+    for indices in groups.values():
+        group = box_array[indices]
+        x_min, y_min = group[:, :2].min(axis=0).tolist()
+        x_max, y_max = group[:, 2:].max(axis=0).tolist()
+        merged_boxes.append((x_min, y_min, x_max, y_max))
+    return merged_boxes
+
+
+def find_root(parents: list[int], index: int) -> int:
+    """
+    Find the root of the union-find tree the index belongs to, compressing the path on the way.
+
+    :param parents: The parent of each index.
+    :param index: The index to find the root of.
+    :return: The root index.
+    """
+    while parents[index] != index:
+        parents[index] = parents[parents[index]]
+        index = parents[index]
+    return index
+
+
+def flatten_boxes(boxes: Iterable[tuple[int, int, int, int]]) -> array:
+    """
+    Pack boxes into a flat int array, four entries per box.
+
+    :param boxes: The boxes to pack.
+    :return: The flat box array.
+    """
+    return array("i", chain.from_iterable(boxes))
+
+
+def box_view(boxes: array) -> np.ndarray:
+    """
+    Get an (N, 4) numpy view of a flat box array, which writes through to the array.
+    The array can't be resized while the view exists.
+
+    :param boxes: The flat box array.
+    :return: The box view.
+    """
+    if not boxes:
+        return np.empty((0, 4), dtype=np.intc)
+    return np.frombuffer(boxes, dtype=np.intc).reshape(-1, 4)
 
 
-@dataclass
+@dataclass(slots=True)
 class MaskFittingResults:
     """
     This is a simple struct to hold the results from the mask fitting process.
@@ -284,7 +464,7 @@ class MaskFittingResults:
         return self.mask_box, self.analytics_std_deviation
 
 
-@dataclass
+@dataclass(slots=True)
 class MaskerData:
     """
     This is a simple struct to hold the inputs for the masker.
@@ -315,7 +495,7 @@ class MaskerData:
     debug: bool
 
 
-@dataclass
+@dataclass(slots=True)
 class MaskData:
     """
     This is a simple struct to hold all the extra information needed to perform the
@@ -344,12 +524,12 @@ class MaskData:
         :param json_str: The json string.
         :return: The MaskData object.
         """
-        data = json.loads(json_str)
+        data = load_json(json_str)
         return cls(
-            Path(data["original_path"]),
-            Path(data["target_path"]),
-            Path(data["base_image_path"]),
-            Path(data["mask_path"]),
+            intern_path(data["original_path"]),
+            intern_path(data["target_path"]),
+            intern_path(data["base_image_path"]),
+            intern_path(data["mask_path"]),
             data["scale"],
             data["boxes_with_deviation"],
         )
@@ -369,11 +549,10 @@ class MaskData:
             "scale": self.scale,
             "boxes_with_deviation": self.boxes_with_deviation,
         }
-        with open(json_path, "w") as f:
-            json.dump(data, f, indent=4)
+        dump_json(data, json_path)
 
 
-@dataclass
+@dataclass(slots=True)
 class DenoiserData:
     """
     This is a simple struct to hold the inputs for the denoiser.
@@ -404,7 +583,7 @@ class DenoiserData:
     debug: bool
 
 
-@dataclass
+@dataclass(slots=True)
 class DenoiseAnalytic:
     """
     Analytics data to visualize the denoising performance.